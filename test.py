@@ -7,36 +7,61 @@ Other scripts will be imported and tested in a new subprocess each.
 
 import argparse
 from contextlib import contextmanager
-from datetime import datetime, timedelta
+from datetime import timedelta
 from functools import wraps
-from importlib import import_module, reload
+import heapq
+from importlib.util import module_from_spec, spec_from_file_location
 import io
 import multiprocessing
+from multiprocessing.connection import Connection
 import os
 from pathlib import Path
+import select
+import selectors
+import struct
 import sys
 import threading
 import time
 import traceback
-from typing import Callable, Dict, List, Optional, Tuple
+from types import ModuleType
+from typing import Callable, Dict, List, Optional, Tuple, Union
 import unittest # This module is not necessary for the testsuite, but will probably ease your testing
 
 
-LIBRARY = None # This will be set to the imported script
-LIBRARY_PATH = None # This will be set to the imported script's path
-
 def load_library_patched(stdin=""):
-  '''Decorator for reloading the library stored in LIBRARY'''
+  '''Decorator for test methods, (re)loading the library at the test's LIBRARY_PATH into its LIBRARY attribute'''
   def outer(func):
     @wraps(func)
-    def inner(*args, **kwargs):
-      global LIBRARY
+    def inner(self, *args, **kwargs):
       with patched_io(stdin) as (_, stdout, stderr):
-        LIBRARY = load_library(LIBRARY_PATH)
-      func(*args, stdout, stderr, **kwargs)
+        self.LIBRARY = load_library(self.LIBRARY_PATH)
+      func(self, *args, stdout, stderr, **kwargs)
     return inner
   return outer
 
+class TestMeta(type):
+  '''
+  Metaclass generating a test method for every entry of the class' TESTS table.
+  Each entry is a tuple (name, stdin, checks) with checks being a list of (actual, expected) pairs;
+  the generated method test_<name> loads the library with the given stdin and asserts actual(library) == expected for each pair in order, stopping at the first mismatch.
+  '''
+  def __new__(mcs, name, bases, namespace):
+    for test_name, stdin, checks in namespace.get('TESTS', ()):
+      method_name = f"test_{test_name}"
+      if method_name in namespace:
+        raise TypeError(f"TESTS entry {test_name!r} clashes with the existing {name}.{method_name}")
+      namespace[method_name] = mcs.generate_test(method_name, stdin, checks)
+    return super().__new__(mcs, name, bases, namespace)
+
+  @staticmethod
+  def generate_test(name: str, stdin: str, checks: List[Tuple[Callable[[ModuleType], object], object]]):
+    @load_library_patched(stdin=stdin)
+    def test(self, load_stdout, load_stderr):
+      for i, (actual, expected) in enumerate(checks):
+        self.assertEqual(actual(self.LIBRARY), expected, f"check {i} of {name} failed")
+    test.__name__ = test.__qualname__ = name
+    return test
+
 
 ################################################################################
 # Add your tests below this comment.
@@ -46,31 +71,31 @@ def load_library_patched(stdin=""):
 TESTSUITE_DESCRIPTION = "testpythonscript sample testsuite" # displayed in help message
 
 def test_main(library_path: Path):
-  global LIBRARY_PATH
-  LIBRARY_PATH = library_path
-  unittest.main(argv=['first-arg-is-ignored'], verbosity=2, exit=False) # https://medium.com/@vladbezden/using-python-unittest-in-ipython-or-jupyter-732448724e31
+  Test.LIBRARY_PATH = library_path
+  run_tests(Test)
 
   print(f"Completed testing {library_path}")
 
-class Test(unittest.TestCase):
-  @load_library_patched(stdin="\n")
-  def test_initial_attributes(self, load_stdout, load_stderr):
-    self.assertTrue(hasattr(LIBRARY, "LIVES"))
-    self.assertEqual(LIBRARY.LIVES, 3)
+class Test(unittest.TestCase, metaclass=TestMeta):
+  LIBRARY_PATH = None # This will be set to the script's path
+  LIBRARY = None # This will be set to the imported script by load_library_patched
+
+  TESTS = [ # (name, stdin, [(actual, expected), ...]); see TestMeta
+    ("initial_attributes", "\n", [(lambda lib: hasattr(lib, "LIVES"), True), (lambda lib: lib.LIVES, 3)]),
+    ("false", "\n", [(lambda lib: lib.return_true(), True)]),
+  ]
 
   @load_library_patched(stdin="\n")
   def test_foo(self, load_stdout, load_stderr):
-    self.assertTrue(hasattr(LIBRARY, "foo"))
+    self.assertTrue(hasattr(self.LIBRARY, "foo"))
     with patched_io() as (stdin, stdout, stderr):
-      LIBRARY.foo()
+      self.LIBRARY.foo()
       self.assertEqual("foo\nbar\n", stdout.getvalue())
 
-  @load_library_patched(stdin="\n")
-  def test_false(self, load_stdout, load_stderr):
-    self.assertTrue(LIBRARY.return_true())
-
   @load_library_patched(stdin="Some stdin patch")
   def test_library_load_stdin(self, load_stdout, load_stderr):
+    if CACHE_LIBRARY:
+      self.skipTest("--cache-library doesn't load the script again, so there is no output of loading it")
     self.assertEqual(f"Library load input() returned: Some stdin patch\n", load_stdout.readlines()[1])
 
 
@@ -82,12 +107,104 @@ class Test(unittest.TestCase):
 
 
 TIMEOUT = None # cli arg; Terminate the subprocess if takes longer to finish gracefully
+CACHE_LIBRARY = None # cli arg; Only reload the library if its file has changed
+FAST = None # cli arg; Call test methods directly instead of using unittest's runner
 
-WAIT_DELAY = timedelta(milliseconds=50)
 OUTPUT_REPORT_DELAY = timedelta(milliseconds=5)
+OUTPUT_READ_SIZE = 65536 # maximum number of bytes a subprocess reports at once
+OUTPUT_LIMIT = 1 << 20 # maximum number of bytes kept of a script's output; the middle of longer outputs is dropped
 TERMINATION_DELAY = OUTPUT_REPORT_DELAY + timedelta(milliseconds=2)
-
-COMMUNICATION_QUEUE = multiprocessing.Queue() # for communication with subprocesses
+SPIN_DURATION = timedelta(microseconds=100) # how long to poll for messages before blocking while many subprocesses are running
+
+TEST_LOADER = unittest.TestLoader()
+
+FORKSERVER_PRELOAD = ['__main__', 'io', 'traceback', 'unittest'] # imported once by the forkserver rather than by every subprocess; '__main__' is this script
+
+# Subprocesses send messages consisting of one of these opcodes followed by its payload
+MESSAGE_OUTPUT = 1 # payload: output bytes
+MESSAGE_TIMEOUT = 2 # payload: the new timeout's time.monotonic_ns() deadline, packed as DEADLINE_FORMAT
+MESSAGE_CANCEL_TIMEOUT = 3 # no payload
+DEADLINE_FORMAT = '!q'
+
+class BoundedBuffer:
+  '''Keeps the beginning and the end of the data written to it, dropping the middle once it exceeds limit bytes'''
+  def __init__(self, limit: int = OUTPUT_LIMIT):
+    self.head = bytearray()
+    self.head_limit = limit // 2
+    self.tail = bytearray(limit - self.head_limit) # circular buffer of the latest bytes, allocated once
+    self.tail_position = 0 # where the next byte goes into tail
+    self.tail_length = 0 # number of bytes in tail
+    self.truncated = 0 # number of bytes dropped
+
+  def write(self, data: bytes):
+    free = self.head_limit - len(self.head)
+    if free > 0:
+      self.head += data[:free]
+      data = data[free:]
+    size = len(self.tail)
+    if len(data) > size:
+      self.truncated += len(data) - size
+      data = data[-size:] # the beginning would be overwritten anyway
+    n = len(data)
+    if not n:
+      return
+    self.truncated += max(0, self.tail_length + n - size)
+    self.tail_length = min(size, self.tail_length + n)
+    first = min(n, size - self.tail_position) # bytes fitting in before wrapping around
+    self.tail[self.tail_position:self.tail_position + first] = data[:first]
+    self.tail[:n - first] = data[first:]
+    self.tail_position = (self.tail_position + n) % size
+
+  def getvalue(self) -> bytes:
+    if self.tail_length == len(self.tail): # the buffer is full, its oldest byte is at tail_position
+      tail = bytes(self.tail[self.tail_position:] + self.tail[:self.tail_position])
+    else: # the buffer hasn't wrapped around yet
+      tail = bytes(self.tail[:self.tail_position])
+    if self.truncated:
+      return bytes(self.head) + f"\n...[truncated {self.truncated} bytes]...\n".encode() + tail
+    return bytes(self.head) + tail
+
+class Timeouts:
+  '''Timeouts of processes; the earliest one is kept at the top of a heap, which is only changed when timeouts are set or expire'''
+  def __init__(self):
+    self.generation = 0 # incremented whenever a timeout is set, so outdated heap entries can be recognized
+    self.current: Dict[int, Tuple[int, int]] = {} # key: pid, value: (deadline, generation) of the current timeout
+    self.heap: List[Tuple[int, int, int]] = [] # [(deadline, generation, pid), (...), ...]; entries whose generation isn't current are outdated
+
+  def __repr__(self) -> str:
+    return f"Timeouts({self.current})"
+
+  def set(self, pid: int, deadline: int):
+    '''Sets the timeout of the given process to the given time.monotonic_ns() deadline'''
+    self.generation += 1
+    self.current[pid] = (deadline, self.generation)
+    heapq.heappush(self.heap, (deadline, self.generation, pid))
+    if len(self.heap) > 2 * len(self.current) + 8: # too many outdated entries, rebuild the heap
+      self.heap = [(d, g, p) for p, (d, g) in self.current.items()]
+      heapq.heapify(self.heap)
+
+  def cancel(self, pid: int):
+    self.current.pop(pid, None) # the heap entry is discarded once it reaches the top
+
+  def earliest(self) -> Optional[int]:
+    while self.heap:
+      deadline, generation, pid = self.heap[0]
+      if pid in self.current and self.current[pid][1] == generation:
+        return deadline
+      heapq.heappop(self.heap) # discard outdated entry
+    return None
+
+  def pop_expired(self, now: int) -> List[Tuple[int, int]]:
+    '''Removes and returns all timeouts whose deadline is not after now'''
+    expired = []
+    while self.earliest() is not None and self.heap[0][0] <= now:
+      deadline, _, pid = heapq.heappop(self.heap)
+      del self.current[pid]
+      expired.append((pid, deadline))
+    return expired
+
+class ProcessExited:
+  '''Item added on behalf of a subprocess once it has terminated'''
 
 @contextmanager
 def patched_io(initial_in=None) -> Tuple[io.StringIO, io.StringIO, io.StringIO]:
@@ -101,84 +218,246 @@ def patched_io(initial_in=None) -> Tuple[io.StringIO, io.StringIO, io.StringIO]:
     sys.stderr.seek(0)
     sys.stdin, sys.stdout, sys.stderr = old_in, old_out, old_err
 
+def run_tests(testcase: type):
+  '''Runs the tests of the given unittest.TestCase and reports the results'''
+  if not FAST:
+    suite = TEST_LOADER.loadTestsFromTestCase(testcase) # a new suite every time, suites drop their tests while running them
+    unittest.TextTestRunner(verbosity=2).run(suite) # the runner has to be created after sys.stderr is redirected
+    return
+
+  counts = {'ok': 0, 'FAIL': 0, 'ERROR': 0, 'skipped': 0, 'expected failure': 0, 'unexpected success': 0}
+  problems: List[Tuple[str, str, str]] = [] # [(outcome, test name, traceback), (...), ...]
+  names = TEST_LOADER.getTestCaseNames(testcase)
+  class_outcome = None # set if the tests of the class can't run at all
+  class_traceback = None
+  if getattr(testcase, '__unittest_skip__', False): # set by a class decorator like @unittest.skip
+    class_outcome = 'skipped'
+  else:
+    try:
+      testcase.setUpClass()
+    except unittest.SkipTest:
+      class_outcome = 'skipped'
+    except KeyboardInterrupt:
+      raise
+    except BaseException:
+      class_outcome = 'ERROR'
+      class_traceback = traceback.format_exc()
+  if class_outcome:
+    for name in names:
+      print(f"{name} ... {class_outcome}")
+      counts[class_outcome] += 1
+      if class_traceback:
+        problems.append((class_outcome, name, class_traceback))
+    names = []
+  for name in names:
+    print(f"{name} ... ", end='')
+    test = testcase(name)
+    method = getattr(test, name)
+    expecting_failure = getattr(testcase, '__unittest_expecting_failure__', False) or getattr(method, '__unittest_expecting_failure__', False)
+    try:
+      if getattr(method, '__unittest_skip__', False): # set by a method decorator like @unittest.skip, unittest doesn't call setUp then
+        raise unittest.SkipTest(getattr(method, '__unittest_skip_why__', ''))
+      try:
+        test.setUp()
+        try:
+          method()
+        finally:
+          test.tearDown()
+      finally:
+        if not test.doCleanups(): # doCleanups swallows the exceptions of cleanup functions
+          raise RuntimeError("a cleanup function raised an exception")
+      outcome = 'unexpected success' if expecting_failure else 'ok'
+    except unittest.SkipTest:
+      outcome = 'skipped'
+    except KeyboardInterrupt:
+      raise
+    except BaseException as e: # including SystemExit, e.g. if the script calls exit()
+      if expecting_failure:
+        outcome = 'expected failure'
+      else:
+        outcome = 'FAIL' if isinstance(e, AssertionError) else 'ERROR'
+        problems.append((outcome, name, traceback.format_exc()))
+    counts[outcome] += 1
+    print(outcome)
+  if not class_outcome:
+    testcase.tearDownClass()
+  print()
+  for outcome, name, tb in problems:
+    print('=' * 70)
+    print(f"{outcome}: {name}")
+    print('-' * 70)
+    print(tb)
+  print(f"Ran {sum(counts.values())} tests: {counts['ok']} ok, {counts['FAIL']} failed, {counts['ERROR']} errors, {counts['skipped']} skipped", end='')
+  print(f", {counts['expected failure']} expected failures, {counts['unexpected success']} unexpected successes" if counts['expected failure'] or counts['unexpected success'] else '')
+
+def writeall(fd: int, buffers: List[bytes]):
+  '''Writes all buffers to the file descriptor, using as few system calls as possible'''
+  buffers = [memoryview(b) for b in buffers if b]
+  while buffers:
+    n = os.writev(fd, buffers)
+    while buffers and n >= len(buffers[0]): # drop what has been written completely
+      n -= len(buffers.pop(0))
+    if n:
+      buffers[0] = buffers[0][n:]
+
 def main():
   args = parse_args()
   scripts: List[Path] = args.script
   max_processes = args.processes
-  global TIMEOUT
-  TIMEOUT = args.timeout
-
-  # queue = multiprocessing.Queue() # for communication with subprocesses
+  configure(args)
+
+  # cpus this process may run on, which can be fewer than the machine has, e.g. in a container or with taskset
+  usable_cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+  multicore = usable_cpus > 1 # spinning only helps if subprocesses can run in the meantime
+
+  if args.pin:
+    # keep the main process on one cpu and spread the subprocesses over the others
+    cpus = sorted(os.sched_getaffinity(0))
+    subprocess_cpus = cpus[1:] or cpus
+    os.sched_setaffinity(0, {cpus[0]})
+    max_processes = min(max_processes, len(subprocess_cpus)) # every subprocess gets a cpu of its own
+  free_cpus: List[int] = list(subprocess_cpus) if args.pin else [] # cpus no running subprocess is pinned to
+  process_cpu: Dict[int, int] = {} # key: pid, value: the cpu the subprocess is pinned to
+
+  if sys.platform.startswith('linux'):
+    # forking is the cheapest way to start a subprocess and is safe here, the main process doesn't run any other threads
+    context = multiprocessing.get_context('fork')
+  else:
+    # fork subprocesses from a server that has already imported the heavyweight modules instead of starting fresh interpreters
+    context = multiprocessing.get_context('forkserver') # runtest and its arguments have to stay picklable for this
+    context.set_forkserver_preload(FORKSERVER_PRELOAD)
 
   index_pid = {} # key: index, value: pid
 
-  outputs: Dict[int, str] = {} # key: pid, value: stdout & stderr for each script
+  outputs: Dict[int, BoundedBuffer] = {} # key: pid, value: stdout & stderr for each script
   exitcodes: Dict[int, int] = {} # key: pid, value: exitcode
 
-  timeouts: List[Tuple[int, datetime]] = [] # [(pid, datetime), (...), ...]
-
-  ready: List[multiprocessing.Process] = list(map(lambda x: multiprocessing.Process(target=runtest, args=(test_main, *x, COMMUNICATION_QUEUE)), enumerate(scripts)))
-  running: List[multiprocessing.Process] = []
+  timeouts = Timeouts()
+
+  ready: List[Tuple[int, Path]] = list(enumerate(scripts))
+  running: Dict[int, multiprocessing.Process] = {} # key: pid
+
+  selector = selectors.DefaultSelector() # watches the connections to and sentinels of all running subprocesses
+
+  def receive(timeout: Optional[float]) -> List[Tuple[int, Union[bytes, ProcessExited]]]:
+    '''Waits at most timeout seconds for subprocesses to report something and returns everything they reported'''
+    messages = []
+    events = []
+    if multicore and len(running) * 2 >= max_processes and timeout != 0:
+      # bursts of messages are likely, spin briefly to avoid the cost of blocking and being woken up again
+      spin_end = time.perf_counter() + SPIN_DURATION.total_seconds()
+      while not events and time.perf_counter() < spin_end:
+        events = selector.select(0)
+    if not events:
+      events = selector.select(timeout)
+    for key, _ in events:
+      process, connection = key.data
+      if key.fileobj is connection:
+        if connection.closed:
+          continue # already drained, the process has terminated
+        try:
+          # a single message per wakeup, the selector reports the connection again while there is more to read
+          messages.append((process.pid, connection.recv_bytes()))
+        except (EOFError, OSError): # OSError if the process died while sending a message
+          selector.unregister(connection)
+          connection.close()
+        continue
+
+      # the sentinel is ready, i.e. the process has terminated and won't send anything else
+      if not connection.closed:
+        try:
+          while connection.poll():
+            messages.append((process.pid, connection.recv_bytes()))
+        except (EOFError, OSError): # OSError if the process died while sending a message
+          pass # keep what has been received so far
+        selector.unregister(connection)
+        connection.close()
+      selector.unregister(process.sentinel)
+      messages.append((process.pid, ProcessExited()))
+    return messages
+
+  def on_output(pid: int, payload: memoryview): # process sent new output
+    # print(f"process {pid} sent its output")
+    outputs[pid].write(payload)
+
+  def on_timeout(pid: int, payload: memoryview): # process set timeout
+    deadline, = struct.unpack(DEADLINE_FORMAT, payload)
+    # print(f"setting timeout of pid {pid} to {deadline}")
+    timeouts.set(pid, deadline)
+
+  def on_cancel_timeout(pid: int, payload: memoryview): # process canceled timeout
+    # print(f"canceling timout of pid {pid}")
+    timeouts.cancel(pid)
+
+  handlers: Dict[int, Callable[[int, memoryview], None]] = { # key: opcode
+    MESSAGE_OUTPUT: on_output,
+    MESSAGE_TIMEOUT: on_timeout,
+    MESSAGE_CANCEL_TIMEOUT: on_cancel_timeout,
+  }
+
+  def dispatch(messages: List[Tuple[int, Union[bytes, ProcessExited]]]):
+    for pid, message in messages:
+      if isinstance(message, ProcessExited): # process terminated
+        p = running.pop(pid)
+        p.join() # reaps the process, it has already terminated
+        print(f"process {pid} finished with exit code {p.exitcode}")
+        exitcodes[pid] = p.exitcode
+        p.close() # release the sentinel right away instead of whenever the process object is collected
+        timeouts.cancel(pid)
+        if pid in process_cpu:
+          free_cpus.append(process_cpu.pop(pid))
+        continue
+      handler = handlers.get(message[0])
+      if handler is None:
+        raise RuntimeWarning("Invalid message received", message)
+      handler(pid, memoryview(message)[1:])
 
   while len(ready) > 0 or len(running) > 0:
-    for i, p in enumerate(running):
-      if not p.is_alive():
-        print(f"process {p.pid} finished with exit code {p.exitcode}")
-        exitcodes[p.pid] = p.exitcode
-        p.join()
-        del running[i]
-
     while 0 < len(ready) and len(running) < max_processes:
-      process = ready.pop()
-      running.append(process)
+      index, script = ready.pop()
+      connection, child_connection = context.Pipe(duplex=False) # one pipe per subprocess
+      process = context.Process(target=runtest, args=(test_main, script, child_connection, args))
       process.start()
+      print(f"process {process.pid} is processing {script}")
+      running[process.pid] = process
+      index_pid[index] = process.pid
+      outputs[process.pid] = BoundedBuffer()
+      if args.pin:
+        cpu = process_cpu[process.pid] = free_cpus.pop()
+        try:
+          os.sched_setaffinity(process.pid, {cpu})
+        except ProcessLookupError:
+          pass # already terminated, the cpu is freed once that is reported
+      child_connection.close()
+      selector.register(connection, selectors.EVENT_READ, (process, connection))
+      selector.register(process.sentinel, selectors.EVENT_READ, (process, connection)) # becomes ready once the process terminates
 
     # print("timeouts", timeouts)
-    while COMMUNICATION_QUEUE.empty() and (len(timeouts) == 0 or timeouts[0][1] > datetime.now()) and (len(running) > 0 and running[0].is_alive()):
-      time.sleep(WAIT_DELAY.total_seconds())
-
-    while not COMMUNICATION_QUEUE.empty():
-      pid, item = COMMUNICATION_QUEUE.get_nowait()
-      if pid not in index_pid.values(): # item is the process index
-        print(f"process {pid} is processing {scripts[item]}")
-        index_pid[item] = pid
-      elif isinstance(item, str): # process sent its output
-        # print(f"process {pid} sent its output")
-        outputs[pid] = item
-      elif isinstance(item, datetime): # process set timeout
-        # print(f"setting timeout of pid {pid} to {item}")
-        for i, (p, t) in enumerate(timeouts):
-          if p == pid:
-            timeouts[i] = (pid, item)
-            break
-        else:
-          timeouts.append((pid, item))
-      elif item is None: # process canceled timeout
-        for i, (p, t) in enumerate(timeouts):
-          if pid == p:
-            # print(f"canceling timout of pid {pid} ({t})")
-            del timeouts[i]
-      else:
-        # pass
-        raise RuntimeWarning("Invalid item in queue", item)
-
-    timeouts.sort(key=lambda x: x[1])
-    time.sleep(TERMINATION_DELAY.total_seconds()) # give timeouted processes enough time to report their output
-    for pid, t in timeouts:
-      if t > datetime.now():
-        break
-      for i, p in enumerate(running):
-        if pid == p.pid and p.is_alive():
-          print(f"process {pid} exceeded its timeout {t} by {datetime.now() - t}, terminating")
-          p.terminate()
-
+    # block until a subprocess reports something or the earliest timeout expires
+    earliest = timeouts.earliest()
+    next_timeout = max(0, earliest - time.monotonic_ns()) / 1e9 if earliest is not None else None
+    dispatch(receive(next_timeout))
+
+    earliest = timeouts.earliest()
+    if earliest is None or earliest > time.monotonic_ns():
+      continue # no timeout is due
+    # give timeouted processes enough time to report their output, handling everything they send in the meantime
+    grace_end = time.perf_counter() + TERMINATION_DELAY.total_seconds()
+    remaining = TERMINATION_DELAY.total_seconds()
+    while remaining > 0:
+      dispatch(receive(remaining))
+      remaining = grace_end - time.perf_counter()
+    for pid, deadline in timeouts.pop_expired(time.monotonic_ns()):
+      p = running.get(pid)
+      if p is not None: # the process has not been reported as terminated
+        print(f"process {pid} exceeded its timeout by {timedelta(microseconds=(time.monotonic_ns() - deadline) // 1000)}, terminating")
+        p.terminate()
+
+  sys.stdout.flush() # the outputs are written to the file descriptor directly, bypassing sys.stdout's buffer
   for i in range(len(scripts)):
     pid = index_pid[i]
-    print('+' * 80)
-    print(f"Output of {scripts[i]} test (exitcode {exitcodes[pid]}):")
-    output = outputs[pid]
-    if output is not None:
-      print(''.join(output))
+    header = f"{'+' * 80}\nOutput of {scripts[i]} test (exitcode {exitcodes[pid]}):\n".encode()
+    writeall(sys.stdout.fileno(), [header, outputs[pid].getvalue(), b'\n']) # the output is passed through as it was written, without decoding it
 
 def parse_args():
   def filetype(filepath):
@@ -196,47 +475,110 @@ def parse_args():
     help="A test will be terminated if it takes longer than this many seconds.",
     type=lambda x: timedelta(seconds=float(x)),
     default="60")
+  parser.add_argument('--cache-library',
+    help="Reuse the loaded script in subsequent tests as long as its file is unchanged, instead of reloading it for every test. Tests will see the state left behind by previous tests and won't observe the output of loading the script again.",
+    action='store_true')
+  parser.add_argument('--fast',
+    help="Call the test methods directly instead of running them with unittest's test runner. This skips most of unittest's machinery and only supports setUp/tearDown(Class), cleanups, skipping and expected failures.",
+    action='store_true')
+  parser.add_argument('--pin',
+    help="Pin the main process to one cpu and every subprocess to one of the remaining cpus that no other subprocess is pinned to. Limits the number of processes to the number of remaining cpus.",
+    action='store_true')
   parser.add_argument('script',
     help="The script file to test. MUST end in '.py' (without quotes)!",
     nargs='+',
     type=filetype)
-  return parser.parse_args()
-
-def runtest(test_function: Callable, index: int, scriptpath: Path, queue: multiprocessing.Queue = COMMUNICATION_QUEUE):
-  output = io.StringIO()
+  args = parser.parse_args()
+  if os.name != 'posix':
+    # subprocess output is read from pipes with os.readv and select, and the selector waits on pipes and process sentinels
+    parser.error("only POSIX systems (e.g. Linux or macOS) are supported")
+  if args.pin and not hasattr(os, 'sched_setaffinity'):
+    parser.error("--pin is not supported on this platform")
+  return args
+
+def configure(args: argparse.Namespace):
+  '''Sets the globals that are derived from cli args'''
+  global TIMEOUT, CACHE_LIBRARY, FAST
+  TIMEOUT = args.timeout
+  CACHE_LIBRARY = args.cache_library
+  FAST = args.fast
+
+def runtest(test_function: Callable, scriptpath: Path, connection: Connection, args: argparse.Namespace):
+  configure(args) # globals are not inherited by subprocesses that are not forked from the main process
+
+  # redirect the file descriptors as well, so output of extension modules and child processes is captured too
+  r, w = os.pipe()
+  os.dup2(w, 1)
+  os.dup2(w, 2)
+  os.close(w)
+  output = open(1, 'w', encoding='utf-8', errors='backslashreplace', buffering=1, closefd=False)
   sys.stdout = output
   sys.stderr = output
-  try:
-    pid = multiprocessing.current_process().pid
-    queue.put((pid, index))
 
-    def reportoutput():
-      while True:
-        queue.put((pid, output.getvalue()))
+  send_lock = threading.Lock() # connections must not be used by several threads at once
+  def send(opcode: int, payload: bytes = b''):
+    with send_lock:
+      connection.send_bytes(bytes((opcode,)) + payload) # avoid pickling
+
+  finished_r, finished_w = os.pipe() # closed once the script is done, processes started by the script may still hold fd 1 and 2 open
+
+  def reportoutput():
+    '''Sends everything written to the pipe until all of its write ends are closed, or until the script is done and nothing more is buffered'''
+    # output is read right behind the opcode of a reused message buffer, so it is sent without being copied
+    message = bytearray(1 + OUTPUT_READ_SIZE)
+    message[0] = MESSAGE_OUTPUT
+    payload = memoryview(message)[1:]
+    drain_end = None # once the script is done, buffered output is only reported until then
+    while True:
+      if drain_end is None and finished_r in select.select([r, finished_r], [], [])[0]:
+        drain_end = time.perf_counter() + OUTPUT_REPORT_DELAY.total_seconds()
+      if drain_end is not None and (time.perf_counter() > drain_end or not select.select([r], [], [], 0)[0]):
+        break
+      n = os.readv(r, [payload])
+      if not n:
+        break
+      if n < OUTPUT_READ_SIZE and drain_end is None:
+        # let subsequent writes accumulate for a moment, so a burst of small writes is reported at once
         time.sleep(OUTPUT_REPORT_DELAY.total_seconds())
+        if select.select([r], [], [], 0)[0]:
+          n += os.readv(r, [payload[n:]])
+      with send_lock:
+        connection.send_bytes(message, 0, 1 + n)
+
+  try:
     t = threading.Thread(target=reportoutput, daemon=True)
     t.start()
 
-    queue.put((pid, datetime.now() + TIMEOUT))
+    send(MESSAGE_TIMEOUT, struct.pack(DEADLINE_FORMAT, time.monotonic_ns() + TIMEOUT // timedelta(microseconds=1) * 1000)) # the monotonic clock is shared by all processes
     test_function(scriptpath)
   except:
-    traceback.print_exception(*sys.exc_info())
-  queue.put((pid, output.getvalue()))
-
-LOADED_LIBRARIES = {}
+    traceback.print_exc()
+  output.flush()
+  os.close(1)
+  os.close(2)
+  os.close(finished_w)
+  t.join()
+  connection.close()
+
+LOADED_LIBRARIES: Dict[Path, Tuple[ModuleType, int]] = {} # key: path, value: (library, modification time of its file when it was loaded)
 def load_library(path: Path):
   '''
   Runs some tests with the given script.
   '''
   assert(path.name.endswith('.py')) # thwart ModuleNotFoundError 
-  lib = LOADED_LIBRARIES.get(path)
-  if lib:
-    lib = reload(lib)
-  else:
+  mtime = path.stat().st_mtime_ns
+  lib, lib_mtime = LOADED_LIBRARIES.get(path, (None, None))
+  if lib and CACHE_LIBRARY and lib_mtime == mtime:
+    return lib
+  if not lib:
     # https://stackoverflow.com/a/52328080/2808520
-    sys.path.insert(0, str(path.parent.absolute()))
-    lib = import_module(path.name[:-3])
-  LOADED_LIBRARIES[path] = lib
+    sys.path.insert(0, str(path.parent.absolute())) # for imports of modules next to the script
+    # a private module name, so a script named like another module (e.g. random.py) doesn't replace it in sys.modules
+    spec = spec_from_file_location(f"_testpythonscript_{path.name[:-3]}", str(path)) # skips searching sys.path for the script itself
+    lib = module_from_spec(spec)
+    sys.modules[spec.name] = lib
+  lib.__spec__.loader.exec_module(lib) # (re)runs the script in the same module object, like reload()
+  LOADED_LIBRARIES[path] = (lib, mtime)
   return lib
 
 if __name__ == '__main__':